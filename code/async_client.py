@@ -0,0 +1,248 @@
+import asyncio
+import warnings
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+import aiohttp
+import astropy.table
+from astropy.io.votable import parse
+from multidict import CIMultiDict
+
+from cfht import cfhtExposureTimeURL, parseCFHTExposureTime
+from staralt import staraltFields, staralt_headers, staralt_url
+from tap_service import dict_TAP_server, tap_adql_query
+
+
+class AsyncObservationClient:
+    # awaitable counterparts of cfht.requestCFHTExposureTime, staralt.getSTARALT and tap_service.tap_query
+    # sharing one aiohttp session (connection pool)
+    # limit_per_host bounds the HTTP requests in flight per host, and since a TAP job releases it
+    # while being polled, job_limit_per_host separately bounds the TAP jobs running per host
+    #
+    # async with AsyncObservationClient(limit_per_host=8) as client:
+    #     texp, table = await asyncio.gather(client.requestCFHTExposureTime(h_mag=7.),
+    #                                        client.tap_query(x, y, z, query_mode='obs'))
+    def __init__(self,
+                 limit_per_host: int = 8,
+                 job_limit_per_host: int = 4,
+                 timeout: float = 3600.,
+                 request_timeout: float = 300.,
+                 poll_interval: float = 1.,
+                 max_poll_interval: float = 30.):
+        self.limit_per_host = limit_per_host
+        self.job_limit_per_host = job_limit_per_host
+        # overall time allowed for one call, a TAP job and its result download included
+        self.timeout = timeout
+        # time allowed to connect and between two reads of a single HTTP request
+        self.request_timeout = request_timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.session: aiohttp.ClientSession | None = None
+        self.__semaphores: dict[str, asyncio.Semaphore] = {}
+        self.__job_semaphores: dict[str, asyncio.Semaphore] = {}
+        # TAP job deletions left running after a call returns
+        self.__background_tasks: set[asyncio.Task] = set()
+
+    async def __aenter__(self):
+        # no total limit, so that a large result may download as long as the call timeout allows
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None,
+                                                                           sock_connect=self.request_timeout,
+                                                                           sock_read=self.request_timeout),
+                                             connector=aiohttp.TCPConnector(limit=0))
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        # a pending job creation may still schedule a deletion, hence the loop
+        while self.__background_tasks:
+            await asyncio.gather(*self.__background_tasks, return_exceptions=True)
+        await self.session.close()
+        self.session = None
+
+    @staticmethod
+    def __host_semaphore(dict_semaphore: dict[str, asyncio.Semaphore], url: str, limit: int) -> asyncio.Semaphore:
+        host = urlsplit(url).hostname
+        if host not in dict_semaphore:
+            dict_semaphore[host] = asyncio.Semaphore(limit)
+        return dict_semaphore[host]
+
+    async def __request(self, method: str, url: str, **kwargs) -> tuple[int, str, CIMultiDict, bytes]:
+        if self.session is None:
+            raise Exception('the client is not opened, use it as \'async with AsyncObservationClient() as client\'')
+        async with self.__host_semaphore(self.__semaphores, url, self.limit_per_host):
+            async with self.session.request(method, url, **kwargs) as response:
+                content = await response.read()
+                if response.status >= 400:
+                    raise Exception(f'{method} {url} fails with HTTP {response.status}\n'
+                                    f'{content.decode("utf-8", errors="replace")}')
+                return response.status, str(response.url), response.headers.copy(), content
+
+    async def requestCFHTExposureTime(self,
+                                      calc_option: int = 1,
+                                      t_eff: float = 3200,
+                                      snr_pixel: float = 100.0,
+                                      h_mag: float = 7.0,
+                                      seeing: float = 1.,
+                                      h2o: float = 1.6,
+                                      air_mass: float = 1.0,
+                                      is_export: bool = False,
+                                      export_dir: str = '../output/',
+                                      export_file_name: str = 't-exp_output.txt',
+                                      timeout: float = None) -> str:
+        request_content = cfhtExposureTimeURL(calc_option=calc_option,
+                                              t_eff=t_eff,
+                                              snr_pixel=snr_pixel,
+                                              h_mag=h_mag,
+                                              seeing=seeing,
+                                              h2o=h2o,
+                                              air_mass=air_mass)
+        _, _, _, content = await asyncio.wait_for(self.__request('GET', request_content),
+                                                  timeout or self.timeout)
+
+        # file writes are kept off the event loop
+        return await asyncio.to_thread(parseCFHTExposureTime, content,
+                                       is_export=is_export,
+                                       export_dir=export_dir,
+                                       export_file_name=export_file_name)
+
+    async def getSTARALT(self,
+                         check_mode='1',
+                         target_name: str = None,
+                         target_ra: str = None,
+                         target_dec: str = None,
+                         target_list: str = None,
+                         obs_year: str = '2023',
+                         obs_month: str = '04', obs_date: str = '15',
+                         observatory_name='Mauna Kea Observatory (Hawaii, USA)',
+                         export_dir='../output/',
+                         export_file_name='response.gif',
+                         timeout: float = None) -> None:
+        fields = staraltFields(check_mode=check_mode,
+                               target_name=target_name,
+                               target_ra=target_ra,
+                               target_dec=target_dec,
+                               target_list=target_list,
+                               obs_year=obs_year,
+                               obs_month=obs_month,
+                               obs_date=obs_date,
+                               observatory_name=observatory_name)
+        form_data = aiohttp.FormData()
+        for key, value in fields.items():
+            if isinstance(value, tuple):
+                file_name, file_content, content_type = value
+                form_data.add_field(key, file_content or '', filename=file_name, content_type=content_type)
+            else:
+                form_data.add_field(key, value)
+
+        # keep the connection in the pool and let aiohttp set the host
+        headers = {key: value for key, value in staralt_headers.items() if key not in ['Host', 'Connection']}
+
+        _, _, _, content = await asyncio.wait_for(self.__request('POST', staralt_url, headers=headers,
+                                                                 data=form_data, ssl=False),
+                                                  timeout or self.timeout)
+        await asyncio.to_thread(self.__export_content, content, export_dir, export_file_name)
+
+    @staticmethod
+    def __export_content(content: bytes, export_dir: str, export_file_name: str) -> None:
+        Path(export_dir).mkdir(parents=True, exist_ok=True)
+        with open(export_dir + export_file_name, 'wb') as file:
+            file.write(content)
+
+    async def tap_query(self,
+                        x_coord: float, y_coord: float, z_coord: float,
+                        query_mode: str,
+                        cut_radius: int = 100, maxrec: int = 10 ** 9,
+                        columns: str = '*',
+                        timeout: float = None) -> astropy.table.table.Table:
+        adql_query = tap_adql_query(x_coord, y_coord, z_coord, query_mode,
+                                    cut_radius=cut_radius, columns=columns)
+        return await asyncio.wait_for(self.__run_tap_job(dict_TAP_server[query_mode], adql_query, maxrec),
+                                      timeout or self.timeout)
+
+    async def __run_tap_job(self, server: str, adql_query: str, maxrec: int) -> astropy.table.table.Table:
+        async with self.__host_semaphore(self.__job_semaphores, server, self.job_limit_per_host):
+            return await self.__run_tap_job_unlimited(server, adql_query, maxrec)
+
+    async def __run_tap_job_unlimited(self, server: str, adql_query: str, maxrec: int) -> astropy.table.table.Table:
+        # TAP async (UWS) job: create and run, poll the phase, fetch the result, then delete the job
+        job_url = None
+        # shielded, so that a job created by the server after a cancellation is still deleted
+        creation = self.__track(asyncio.create_task(
+            self.__request('POST', server + '/async',
+                           data={'REQUEST': 'doQuery',
+                                 'LANG': 'ADQL',
+                                 'QUERY': adql_query,
+                                 'FORMAT': 'votable',
+                                 'MAXREC': str(maxrec),
+                                 'PHASE': 'RUN'},
+                           allow_redirects=False)))
+        try:
+            try:
+                status, url, headers, content = await asyncio.shield(creation)
+            except asyncio.CancelledError:
+                creation.add_done_callback(self.__delete_created_job)
+                raise
+            if (status not in [200, 303]) or ('Location' not in headers):
+                raise Exception(f'fail to create TAP job at {server} (HTTP {status})\n'
+                                f'{content.decode("utf-8", errors="replace")}')
+            job_url = urljoin(url, headers['Location'])
+
+            interval = self.poll_interval
+            while True:
+                _, _, _, content = await self.__request('GET', job_url + '/phase')
+                phase = content.decode('utf-8', errors='replace').strip()
+                if phase == 'COMPLETED':
+                    break
+                elif phase in ['ERROR', 'ABORTED']:
+                    _, _, _, content = await self.__request('GET', job_url + '/error')
+                    raise Exception(f'TAP job {job_url} ends in phase {phase}\n'
+                                    f'{content.decode("utf-8", errors="replace")}')
+                elif phase == 'PENDING':
+                    await self.__request('POST', job_url + '/phase', data={'PHASE': 'RUN'})
+                elif phase not in ['QUEUED', 'EXECUTING', 'HELD', 'SUSPENDED']:
+                    raise Exception(f'unexpected phase of TAP job {job_url}\n{phase}')
+                await asyncio.sleep(interval)
+                interval = min(interval * 1.5, self.max_poll_interval)
+
+            _, _, _, content = await self.__request('GET', job_url + '/results/result')
+            # parsing a large VOTable is CPU bound, keep it off the event loop
+            return await asyncio.to_thread(self.__parse_tap_result, content, maxrec)
+        finally:
+            # also on cancellation and timeout, so that no job is left on the server,
+            # without holding up the caller past its deadline
+            if job_url is not None:
+                self.__track(asyncio.create_task(self.__delete_tap_job(job_url)))
+
+    def __track(self, task: asyncio.Task) -> asyncio.Task:
+        # keep a reference to tasks outliving a call, awaited before the session closes
+        self.__background_tasks.add(task)
+        task.add_done_callback(self.__background_tasks.discard)
+        return task
+
+    def __delete_created_job(self, creation: asyncio.Task) -> None:
+        if creation.cancelled() or (creation.exception() is not None):
+            return
+        _, url, headers, _ = creation.result()
+        if 'Location' in headers:
+            self.__track(asyncio.create_task(self.__delete_tap_job(urljoin(url, headers['Location']))))
+
+    async def __delete_tap_job(self, job_url: str, timeout: float = 10.) -> None:
+        # bypass the per-host semaphore, as a deletion should not queue behind other requests
+        try:
+            async with self.session.post(job_url, data={'ACTION': 'DELETE'}, allow_redirects=False,
+                                         timeout=aiohttp.ClientTimeout(total=timeout)):
+                pass
+        except Exception:
+            pass
+
+    @staticmethod
+    def __parse_tap_result(content: bytes, maxrec: int) -> astropy.table.table.Table:
+        # as pyvo does for tap_service.tap_query: check QUERY_STATUS and name the columns by name
+        votable = parse(BytesIO(content))
+        for info in votable.iter_info():
+            if info.name == 'QUERY_STATUS':
+                if info.value == 'ERROR':
+                    raise Exception(f'TAP query failed: {info.content}')
+                elif info.value == 'OVERFLOW':
+                    warnings.warn(f'TAP result truncated at MAXREC={maxrec}')
+        return votable.get_first_table().to_table(use_names_over_ids=True)
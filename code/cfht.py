@@ -8,17 +8,13 @@ import re
 # CALCOPT=1 / compute e-time
 
 
-def requestCFHTExposureTime(calc_option: int = 1,
-                            t_eff: float = 3200,
-                            snr_pixel: float = 100.0,
-                            h_mag: float = 7.0,
-                            seeing: float = 1.,
-                            h2o: float = 1.6,
-                            air_mass: float = 1.0,
-                            # detailed_info: bool = False,
-                            is_export: bool = False,
-                            export_dir: str = '../output/',
-                            export_file_name: str = 't-exp_output.txt') -> str:
+def cfhtExposureTimeURL(calc_option: int = 1,
+                        t_eff: float = 3200,
+                        snr_pixel: float = 100.0,
+                        h_mag: float = 7.0,
+                        seeing: float = 1.,
+                        h2o: float = 1.6,
+                        air_mass: float = 1.0) -> str:
     request_head = 'https://etc.cfht.hawaii.edu/cgi-bin/spi/etc.pl?'
     # if detailed_info:
     request_end = 'DETAILS=1'
@@ -46,23 +42,55 @@ def requestCFHTExposureTime(calc_option: int = 1,
     request_content += param_snr_pixel + param_h_mag + param_t_eff
     request_content += param_see + param_rstar + param_dist
     request_content += param_h2o + param_air_mass + request_end
+    return request_content
 
-    response = requests.get(request_content)
 
+def parseCFHTExposureTime(response_content: bytes,
+                          is_export: bool = False,
+                          export_dir: str = '../output/',
+                          export_file_name: str = 't-exp_output.txt') -> str:
     if is_export:
         Path(export_dir).mkdir(parents=True, exist_ok=True)
         with open(export_dir + export_file_name, 'wb') as file:
-            file.write(response.content)
+            file.write(response_content)
 
     exposure_time = re.search(r"(?<=texp=)[-+]?[0-9]*\.?[0-9]+s",
-                              response.text)[0]
+                              response_content.decode('utf-8', errors='replace'))
     # encounter unexpected response
     if exposure_time is None:
         Path('../error/').mkdir(parents=True, exist_ok=True)
         with open('../error/error_output.txt', 'wb') as file:
-            file.write(response.content)
+            file.write(response_content)
+        return str(exposure_time)
+
+    return str(exposure_time[0])
+
+
+def requestCFHTExposureTime(calc_option: int = 1,
+                            t_eff: float = 3200,
+                            snr_pixel: float = 100.0,
+                            h_mag: float = 7.0,
+                            seeing: float = 1.,
+                            h2o: float = 1.6,
+                            air_mass: float = 1.0,
+                            # detailed_info: bool = False,
+                            is_export: bool = False,
+                            export_dir: str = '../output/',
+                            export_file_name: str = 't-exp_output.txt') -> str:
+    request_content = cfhtExposureTimeURL(calc_option=calc_option,
+                                          t_eff=t_eff,
+                                          snr_pixel=snr_pixel,
+                                          h_mag=h_mag,
+                                          seeing=seeing,
+                                          h2o=h2o,
+                                          air_mass=air_mass)
+
+    response = requests.get(request_content)
 
-    return str(exposure_time)
+    return parseCFHTExposureTime(response.content,
+                                 is_export=is_export,
+                                 export_dir=export_dir,
+                                 export_file_name=export_file_name)
 
 
 # not ready!!
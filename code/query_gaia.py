@@ -1,4 +1,5 @@
 import argparse
+import sys
 from pathlib import Path
 
 import astropy.table
@@ -37,7 +38,22 @@ parser.add_argument('-z', '--galactic_z', type=float, dest='z', default=None,
 # flag
 parser.add_argument('-s', '--strict_mode', type=bool, dest='strict', default=True,
                     help='whether to end the process if abnormal occurs, default TRUE')
+# pre-flight
+parser.add_argument('--dry_run', action='store_true', dest='dry_run',
+                    help='only estimate rows, size and download time of the queries')
+parser.add_argument('--sample', type=float, dest='sample', default=None,
+                    help='estimate Gaia DR3 rows from this fraction of the catalogue via random_index')
+parser.add_argument('--max_rows', type=int, dest='max_rows', default=None,
+                    help='estimated row count above which the query is warned about or sharded')
+parser.add_argument('--max_mb', type=float, dest='max_mb', default=None,
+                    help='estimated size in MB above which the query is warned about or sharded')
+parser.add_argument('--auto_shard', action='store_true', dest='auto_shard',
+                    help='split queries above the limits into slabs instead of only warning')
+parser.add_argument('--bandwidth', type=float, dest='bandwidth', default=2.,
+                    help='assumed download bandwidth in MB/s for the time estimate')
 args = parser.parse_args()
+if (args.sample is not None) and (not args.dry_run) and (args.max_rows is None) and (args.max_mb is None):
+    parser.error('--sample only applies to the estimate, use it with --dry_run, --max_rows or --max_mb')
 
 
 # TODO query star info from known catalogue or SIMBAD
@@ -113,12 +129,35 @@ if __name__ == "__main__":
     print('the cartesian coordinate of the cluster centre is')
     print(f'({galactic_x}, {galactic_y}, {galactic_z})')
 
+    # centre of the selection, read back by summarize_gaia.py
+    centre_meta = {'CEN_X': galactic_x, 'CEN_Y': galactic_y, 'CEN_Z': galactic_z}
+
+    preflight_params = {'max_rows': args.max_rows,
+                        'max_bytes': None if args.max_mb is None else args.max_mb * 10 ** 6,
+                        'auto_shard': args.auto_shard,
+                        'bandwidth': args.bandwidth * 10 ** 6}
+
+    if args.dry_run:
+        print('estimating Gaia DR3 query...')
+        tap_query(x_coord=galactic_x, y_coord=galactic_y, z_coord=galactic_z,
+                  query_mode='obs', cut_radius=cut_radius, dry_run=True,
+                  sample_fraction=args.sample, bandwidth=args.bandwidth * 10 ** 6)
+        print('estimating Gaia EDR3 mock query...')
+        tap_query(x_coord=galactic_x, y_coord=galactic_y, z_coord=galactic_z,
+                  query_mode='mock', cut_radius=cut_radius, dry_run=True,
+                  bandwidth=args.bandwidth * 10 ** 6)
+        sys.exit()
+
     print('querying for Gaia DR3...', end='\r')
     obs_table_src = tap_query(x_coord=galactic_x,
                               y_coord=galactic_y,
                               z_coord=galactic_z,
-                              query_mode='obs')
+                              query_mode='obs',
+                              cut_radius=cut_radius,
+                              sample_fraction=args.sample,
+                              **preflight_params)
     obs_table = fix_data_type(obs_table_src)
+    obs_table.meta.update(centre_meta)
     print('saving query result of Gaia DR3...', end='\r')
     obs_table.write(export_dir + f'{target_name}_{cut_radius}.fits', overwrite=True)
     print(f'Gaia DR3 of {target_name} data saved')
@@ -127,8 +166,11 @@ if __name__ == "__main__":
     mock_table_src = tap_query(x_coord=galactic_x,
                                y_coord=galactic_y,
                                z_coord=galactic_z,
-                               query_mode='mock')
+                               query_mode='mock',
+                               cut_radius=cut_radius,
+                               **preflight_params)
     mock_table = fix_data_type(mock_table_src)
+    mock_table.meta.update(centre_meta)
     print('saving query result of Gaia EDR3 mock...', end='\r')
     mock_table.write(export_dir + f'{target_name}_mock_{cut_radius}.fits', overwrite=True)
     print(f'Gaia EDR3 mock of {target_name} data saved')
@@ -2,6 +2,65 @@ import requests
 from requests_toolbelt.multipart.encoder import MultipartEncoder
 from pathlib import Path
 
+staralt_url = 'http://catserver.ing.iac.es/staralt/index.php'
+
+staralt_boundary = '----WebKitFormBoundarywZnma1H8zs5PTGLW'
+
+# the Content-Type is added along with the multipart boundary of each client
+staralt_headers = {
+    'Host': 'catserver.ing.iac.es',
+    # 'Content-Length': '1446',
+    'Cache-Control': 'max-age=0',
+    'Upgrade-Insecure-Requests': '1',
+    'Origin': 'http://catserver.ing.iac.es',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
+                  'AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/105.0.5195.102 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,'
+              'image/avif,image/webp,image/apng,*/*;q=0.8,'
+              'application/signed-exchange;v=b3;q=0.9',
+    'Referer': 'http://catserver.ing.iac.es/staralt/',
+    # 'Accept-Encoding': 'gzip, deflate',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Connection': 'close',
+}
+
+
+def staraltFields(check_mode='1',
+                  target_name: str = None,
+                  target_ra: str = None,
+                  target_dec: str = None,
+                  target_list: str = None,
+                  obs_year: str = '2023',
+                  obs_month: str = '04', obs_date: str = '15',
+                  observatory_name='Mauna Kea Observatory (Hawaii, USA)') -> dict:
+    if (target_name is None) and (target_list is None):
+        raise Exception('target and target list cannot be None in the same time!')
+
+    target = '{} {} {}'.format(target_name, target_ra, target_dec)
+
+    return {
+        'action': 'showImage',
+        # mode
+        'form[mode]': check_mode,
+        # observation date
+        'form[year]': obs_year,
+        'form[month]': obs_month,
+        'form[day]': obs_date,
+        # observatory
+        'form[obs_name]': observatory_name,
+        # coordinates
+        'form[coordlist]': target,
+        # 'form[coordlist]': 'T 34.2 52.2\nA 23.3 -46.4',
+        'Content-Type': 'application/octet-stream',
+        'coordfile': (
+            '', target_list, 'application/octet-stream'),
+        # other options
+        'form[paramdist]': '2',
+        'form[minangle]': '10',
+        'form[format]': 'gif',
+    }
+
 
 def getSTARALT(check_mode='1',
                target_name: str = None,
@@ -13,56 +72,23 @@ def getSTARALT(check_mode='1',
                observatory_name='Mauna Kea Observatory (Hawaii, USA)',
                export_dir='../output/',
                export_file_name='response.gif') -> None:
-    if (target_name is None) and (target_list is None):
-        raise Exception('target and target list cannot be None in the same time!')
-
-    target = '{} {} {}'.format(target_name, target_ra, target_dec)
-
     encoded_data = MultipartEncoder(
-        fields={
-            'action': 'showImage',
-            # mode
-            'form[mode]': check_mode,
-            # observation date
-            'form[year]': obs_year,
-            'form[month]': obs_month,
-            'form[day]': obs_date,
-            # observatory
-            'form[obs_name]': observatory_name,
-            # coordinates
-            'form[coordlist]': target,
-            # 'form[coordlist]': 'T 34.2 52.2\nA 23.3 -46.4',
-            'Content-Type': 'application/octet-stream',
-            'coordfile': (
-                '', target_list, 'application/octet-stream'),
-            # other options
-            'form[paramdist]': '2',
-            'form[minangle]': '10',
-            'form[format]': 'gif',
-        },
-        boundary='----WebKitFormBoundarywZnma1H8zs5PTGLW'
+        fields=staraltFields(check_mode=check_mode,
+                             target_name=target_name,
+                             target_ra=target_ra,
+                             target_dec=target_dec,
+                             target_list=target_list,
+                             obs_year=obs_year,
+                             obs_month=obs_month,
+                             obs_date=obs_date,
+                             observatory_name=observatory_name),
+        boundary=staralt_boundary
     )
 
-    headers = {
-        'Host': 'catserver.ing.iac.es',
-        # 'Content-Length': '1446',
-        'Cache-Control': 'max-age=0',
-        'Upgrade-Insecure-Requests': '1',
-        'Origin': 'http://catserver.ing.iac.es',
-        'Content-Type': 'multipart/form-data; boundary=----WebKitFormBoundarywZnma1H8zs5PTGLW',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
-                      'AppleWebKit/537.36 (KHTML, like Gecko) '
-                      'Chrome/105.0.5195.102 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,'
-                  'image/avif,image/webp,image/apng,*/*;q=0.8,'
-                  'application/signed-exchange;v=b3;q=0.9',
-        'Referer': 'http://catserver.ing.iac.es/staralt/',
-        # 'Accept-Encoding': 'gzip, deflate',
-        'Accept-Language': 'en-US,en;q=0.9',
-        'Connection': 'close',
-    }
+    headers = {**staralt_headers,
+               'Content-Type': f'multipart/form-data; boundary={staralt_boundary}'}
 
-    response = requests.post('http://catserver.ing.iac.es/staralt/index.php',
+    response = requests.post(staralt_url,
                              headers=headers, data=encoded_data, verify=False)
     Path(export_dir).mkdir(parents=True, exist_ok=True)
     with open(export_dir + export_file_name, 'wb') as file:
@@ -0,0 +1,191 @@
+import argparse
+import json
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from astropy.io import fits
+
+parser = argparse.ArgumentParser()
+parser.description = 'summarize the obs and mock tables downloaded by query_gaia.py'
+parser.add_argument('-i', '--input_dir', type=str, dest='input_dir', default='src_data/',
+                    help='directory holding one sub-directory per cluster')
+parser.add_argument('-o', '--output', type=str, dest='output', default='src_data/summary.csv',
+                    help='path of the summary csv')
+parser.add_argument('-c', '--cache', type=str, dest='cache', default='src_data/summary_cache.json',
+                    help='path of the cache of per-file aggregates')
+parser.add_argument('-w', '--workers', type=int, dest='workers', default=None,
+                    help='number of worker processes, default the number of CPUs')
+# bin width
+parser.add_argument('--r_width', type=float, dest='r_width', default=5.,
+                    help='bin width of the radial density profile (pc)')
+parser.add_argument('--mag_width', type=float, dest='mag_width', default=0.5,
+                    help='bin width of the G magnitude counts (mag)')
+parser.add_argument('--plx_width', type=float, dest='plx_width', default=0.1,
+                    help='bin width of the parallax histogram (mas)')
+
+# <name>_<r>.fits and <name>_mock_<r>.fits as written by query_gaia.py
+file_pattern = re.compile(r'^(?P<name>.+?)(?P<mock>_mock)?_(?P<radius>\d+)\.fits$')
+
+# only these columns are read from each table
+summary_columns = ['X', 'Y', 'Z', 'phot_g_mean_mag', 'parallax']
+
+
+def _grid_edges(values: np.ndarray, width: float) -> np.ndarray:
+    # edges at integer multiples of width, computed from the index alone,
+    # so that the same bin has bit-identical edges in every file
+    if len(values) == 0:
+        return np.array([0., width])
+    idx_low = int(np.floor(values.min() / width))
+    idx_high = int(np.floor(values.max() / width)) + 1
+    return np.arange(idx_low, idx_high + 1) * width
+
+
+def summarize_file(file_path: str, radius: float,
+                   r_width: float, mag_width: float, plx_width: float) -> dict:
+    with fits.open(file_path, memmap=True) as hdul:
+        header = hdul[1].header
+        data = hdul[1].data
+        dict_col = {col_name: np.asarray(data[col_name], dtype=float) for col_name in summary_columns}
+
+    coords = np.vstack([dict_col['X'], dict_col['Y'], dict_col['Z']])
+    coords = coords[:, np.isfinite(coords).all(axis=0)]
+    # centre written by query_gaia.py, or the middle of the extent of the sphere for older files
+    if all(key in header for key in ['CEN_X', 'CEN_Y', 'CEN_Z']):
+        centre = np.array([header['CEN_X'], header['CEN_Y'], header['CEN_Z']])
+    elif coords.shape[1] > 0:
+        centre = (coords.min(axis=1) + coords.max(axis=1)) / 2
+    else:
+        centre = np.zeros(3)
+
+    dist = np.sqrt(((coords - centre[:, None]) ** 2).sum(axis=0))
+    # the last shell ends at the selection radius; rounding keeps float noise
+    # (e.g. 21 / 0.7 = 30.000000000000004) from adding a shell beyond it
+    n_shell = int(np.ceil(round(radius / r_width, 9)))
+    r_edges = np.append(np.arange(n_shell) * r_width, radius)
+    r_count, _ = np.histogram(dist, bins=r_edges)
+    shell_volume = 4 / 3 * np.pi * (r_edges[1:] ** 3 - r_edges[:-1] ** 3)
+
+    mag = dict_col['phot_g_mean_mag'][np.isfinite(dict_col['phot_g_mean_mag'])]
+    mag_edges = _grid_edges(mag, mag_width)
+    mag_count, _ = np.histogram(mag, bins=mag_edges)
+
+    plx = dict_col['parallax'][np.isfinite(dict_col['parallax'])]
+    plx_edges = _grid_edges(plx, plx_width)
+    plx_count, _ = np.histogram(plx, bins=plx_edges)
+
+    return {'n_rows': len(dict_col['X']),
+            'centre': centre.tolist(),
+            'radial_density': {'edges': r_edges.tolist(),
+                               'values': (r_count / shell_volume).tolist()},
+            'g_mag_count': {'edges': mag_edges.tolist(),
+                            'values': mag_count.tolist()},
+            'parallax_count': {'edges': plx_edges.tolist(),
+                               'values': plx_count.tolist()}}
+
+
+def scan_files(input_dir: str) -> list[dict]:
+    list_file = []
+    for file_path in sorted(Path(input_dir).glob('*/*.fits')):
+        match = file_pattern.match(file_path.name)
+        # skip anything not written by query_gaia.py
+        if (match is None) or (match['name'] != file_path.parent.name):
+            continue
+        stat = file_path.stat()
+        list_file.append({'path': str(file_path),
+                          'cluster_name': match['name'],
+                          'radius': int(match['radius']),
+                          'source': 'mock' if match['mock'] else 'obs',
+                          'mtime': stat.st_mtime,
+                          'size': stat.st_size})
+    return list_file
+
+
+def _write_cache(dict_cache: dict, cache_path: str) -> None:
+    # write to a temporary file first, so that an interruption never leaves a broken cache
+    Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+    temp_path = Path(cache_path).with_suffix('.tmp')
+    with open(temp_path, 'w') as file:
+        json.dump(dict_cache, file)
+    temp_path.replace(cache_path)
+
+
+def summarize_all(input_dir: str = 'src_data/',
+                  cache_path: str = 'src_data/summary_cache.json',
+                  workers: int = None,
+                  r_width: float = 5., mag_width: float = 0.5, plx_width: float = 0.1) -> pd.DataFrame:
+    bin_config = {'r_width': r_width, 'mag_width': mag_width, 'plx_width': plx_width}
+    dict_cache = {}
+    if Path(cache_path).exists():
+        with open(cache_path, 'r') as file:
+            dict_cache = json.load(file)
+    # a change of binning invalidates every cached aggregate
+    if dict_cache.get('bin_config') != bin_config:
+        dict_cache = {'bin_config': bin_config, 'files': {}}
+
+    list_file = scan_files(input_dir)
+    list_stale = [item for item in list_file
+                  if (item['path'] not in dict_cache['files'])
+                  or (dict_cache['files'][item['path']]['mtime'] != item['mtime'])
+                  or (dict_cache['files'][item['path']]['size'] != item['size'])]
+    print(f'{len(list_file)} tables found, {len(list_stale)} to be (re)processed')
+
+    list_failed = []
+    if list_stale:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            dict_future = {executor.submit(summarize_file, item['path'], item['radius'], **bin_config): item
+                           for item in list_stale}
+            for n_done, future in enumerate(as_completed(dict_future), start=1):
+                item = dict_future[future]
+                try:
+                    dict_cache['files'][item['path']] = {**item, 'summary': future.result()}
+                    print(f'summarized {item["path"]}')
+                except Exception as exception:
+                    # a stale entry of the failed file is dropped as well
+                    dict_cache['files'].pop(item['path'], None)
+                    list_failed.append(item['path'])
+                    print(f'failed to summarize {item["path"]}, skipping it: {exception}')
+                # keep what is done so far in case the run is interrupted
+                if n_done % 20 == 0:
+                    _write_cache(dict_cache, cache_path)
+        if list_failed:
+            print(f'{len(list_failed)} tables failed:')
+            for path in list_failed:
+                print(f'  {path}')
+
+    # drop files which no longer exist
+    set_path = {item['path'] for item in list_file}
+    dict_cache['files'] = {path: entry for path, entry in dict_cache['files'].items() if path in set_path}
+    _write_cache(dict_cache, cache_path)
+
+    list_row = []
+    for entry in dict_cache['files'].values():
+        for statistic in ['radial_density', 'g_mag_count', 'parallax_count']:
+            edges = entry['summary'][statistic]['edges']
+            values = entry['summary'][statistic]['values']
+            for idx, value in enumerate(values):
+                list_row.append({'cluster_name': entry['cluster_name'],
+                                 'radius': entry['radius'],
+                                 'source': entry['source'],
+                                 'statistic': statistic,
+                                 'bin_low': edges[idx],
+                                 'bin_high': edges[idx + 1],
+                                 'value': value})
+    return pd.DataFrame(list_row, columns=['cluster_name', 'radius', 'source', 'statistic',
+                                           'bin_low', 'bin_high', 'value'])
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    summary = summarize_all(input_dir=args.input_dir,
+                            cache_path=args.cache,
+                            workers=args.workers,
+                            r_width=args.r_width,
+                            mag_width=args.mag_width,
+                            plx_width=args.plx_width)
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    summary.to_csv(args.output, index=False)
+    print(f'summary of {summary["cluster_name"].nunique()} clusters saved to {args.output}')
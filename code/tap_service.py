@@ -1,5 +1,8 @@
+import math
+
 import astropy.table
 import pyvo
+import requests
 from astropy import units
 from astropy.coordinates import Distance, SkyCoord
 
@@ -143,34 +146,218 @@ dict_TAP_server = {
     # Gaia EDR3 mock
     'mock': 'https://dc.zah.uni-heidelberg.de/__system__/tap/run/tap'}
 
+dict_TAP_table = {
+    # Gaia DR3
+    'obs': 'gaiadr3.gaia_source',
+    # Gaia EDR3 mock
+    'mock': 'gedr3mock.main'}
 
-def tap_query(x_coord: float, y_coord: float, z_coord: float,
-              query_mode: str,
-              cut_radius: int = 100, maxrec: int = 10 ** 9) -> astropy.table.table.Table:
-    adql_query = ''
-    print(f'querying from {dict_TAP_server[query_mode]}', end='\r')
+# number of sources in gaiadr3.gaia_source, i.e. the range of g.random_index
+GAIA_DR3_SOURCE_COUNT = 1811709771
+
+# galactic Cartesian coordinates (pc) derived from parallax, l and b
+adql_x = '1000/g.parallax*cos(g.b*3.1415/180)*cos(g.l*3.1415/180)'
+adql_y = '1000/g.parallax*cos(g.b*3.1415/180)*sin(g.l*3.1415/180)'
+adql_z = '1000/g.parallax*sin(g.b*3.1415/180)'
+
+
+def _adql_select(columns: str = '*', top: int = None) -> str:
+    adql_query = 'SELECT ' if top is None else f'SELECT TOP {top} '
+    adql_query += f'{columns},{adql_x} as X,{adql_y} as Y,{adql_z} as Z '
+    return adql_query
+
+
+def _adql_from_where(x_coord: float, y_coord: float, z_coord: float,
+                     query_mode: str, cut_radius: int = 100) -> str:
+    adql_query = f'FROM {dict_TAP_table[query_mode]} as g '
     if query_mode == 'obs':
-        adql_query += 'SELECT *,'
-        adql_query += '1000/g.parallax*cos(g.b*3.1415/180)*cos(g.l*3.1415/180) as X,'
-        adql_query += '1000/g.parallax*cos(g.b*3.1415/180)*sin(g.l*3.1415/180) as Y,'
-        adql_query += '1000/g.parallax*sin(g.b*3.1415/180) as Z '
-        adql_query += 'FROM gaiadr3.gaia_source as g '
         adql_query += 'WHERE (g.parallax_over_error > 10) AND (g.astrometric_excess_noise < 1) AND '
     elif query_mode == 'mock':
-        adql_query += 'SELECT * '
-        adql_query += '1000/g.parallax*cos(g.b*3.1415/180)*cos(g.l*3.1415/180) as X,'
-        adql_query += '1000/g.parallax*cos(g.b*3.1415/180)*sin(g.l*3.1415/180) as Y,'
-        adql_query += '1000/g.parallax*sin(g.b*3.1415/180) as Z '
-        adql_query += 'FROM gedr3mock.main as g '
         adql_query += 'WHERE (g.parallax/g.parallax_error > 10) AND (g.popid != 11) AND '
-    else:
+    # every source in the sphere lies between d - r and d + r from the Sun, with d the distance to the centre;
+    # bounding the parallax lets the server use its index instead of evaluating the sphere on every row
+    centre_dist = math.sqrt(x_coord ** 2 + y_coord ** 2 + z_coord ** 2)
+    adql_query += f'(g.parallax > {1000 / (centre_dist + cut_radius)}) AND '
+    if centre_dist > cut_radius:
+        adql_query += f'(g.parallax < {1000 / (centre_dist - cut_radius)}) AND '
+    adql_query += f'(sqrt(power(({adql_x} - ({x_coord})),2) + '
+    adql_query += f'power(({adql_y} - ({y_coord})),2) + '
+    adql_query += f'power(({adql_z} - ({z_coord})),2)) < {cut_radius})'
+    return adql_query
+
+
+def tap_adql_query(x_coord: float, y_coord: float, z_coord: float,
+                   query_mode: str,
+                   cut_radius: int = 100, columns: str = '*') -> str:
+    _check_query_mode(query_mode)
+    return _adql_select(columns) + _adql_from_where(x_coord, y_coord, z_coord, query_mode, cut_radius)
+
+
+def _check_query_mode(query_mode: str) -> None:
+    if query_mode not in dict_TAP_server:
         raise Exception(f'\'{query_mode}\' should be \'obs\' or \'mock\'\n'
                         'check the input mode')
-    adql_query += f'(sqrt(power((1000/g.parallax*cos(g.b*3.1415/180) * cos(g.l*3.1415/180) - ({x_coord})),2) + '
-    adql_query += f'power((1000/g.parallax*cos(g.b*3.1415/180) * sin(g.l*3.1415/180) - ({y_coord})),2) + '
-    adql_query += f'power((1000/g.parallax*sin(g.b*3.1415/180) - ({z_coord})),2)) < {cut_radius})'
 
+
+# row size per (query_mode, columns), which does not depend on the sphere
+dict_row_bytes = {}
+
+
+def _votable_row_bytes(query_mode: str, columns: str = '*',
+                       n_small: int = 10, n_large: int = 110,
+                       timeout: float = 60.) -> float:
+    # size of one row in the VOTable returned by the server, variable-length strings included,
+    # from the difference between two TOP-N samples so that the header is not counted
+    if (query_mode, columns) in dict_row_bytes:
+        return dict_row_bytes[(query_mode, columns)]
+    list_size = []
+    for n_top in [n_small, n_large]:
+        row_query = _adql_select(columns, top=n_top)
+        row_query += f'FROM {dict_TAP_table[query_mode]} as g WHERE (g.parallax > 0)'
+        response = requests.post(dict_TAP_server[query_mode] + '/sync',
+                                 data={'REQUEST': 'doQuery', 'LANG': 'ADQL', 'QUERY': row_query},
+                                 timeout=timeout)
+        response.raise_for_status()
+        list_size.append(len(response.content))
+    dict_row_bytes[(query_mode, columns)] = (list_size[1] - list_size[0]) / (n_large - n_small)
+    return dict_row_bytes[(query_mode, columns)]
+
+
+def tap_estimate(x_coord: float, y_coord: float, z_coord: float,
+                 query_mode: str,
+                 cut_radius: int = 100, columns: str = '*',
+                 sample_fraction: float = None,
+                 bandwidth: float = 2 * 10 ** 6) -> dict:
+    # rows: COUNT(*) over the same predicate, or over a random_index subset scaled up (obs only)
+    # bytes: rows times the size of a downloaded row of the chosen columns (see _votable_row_bytes)
+    # download_time: bytes over the assumed bandwidth (bytes/s)
+    _check_query_mode(query_mode)
     tap_service = pyvo.dal.TAPService(dict_TAP_server[query_mode])
-    result = tap_service.run_async(adql_query, maxrec=maxrec)
 
-    return result.to_table()
+    count_query = 'SELECT COUNT(*) AS n '
+    count_query += _adql_from_where(x_coord, y_coord, z_coord, query_mode, cut_radius)
+    if sample_fraction is not None:
+        if query_mode != 'obs':
+            raise Exception('sampling via random_index is only available in \'obs\' mode')
+        if not 0 < sample_fraction <= 1:
+            raise Exception(f'\'{sample_fraction}\' is not a valid sample fraction, '
+                            'which lies between 0 and 1')
+        count_query += f' AND (g.random_index < {int(sample_fraction * GAIA_DR3_SOURCE_COUNT)})'
+    row_bytes = _votable_row_bytes(query_mode, columns)
+    # as an async job, since the unsampled count scans the whole table and exceeds the sync time limit
+    n_count = int(tap_service.run_async(count_query).to_table()[0][0])
+    n_rows = n_count if sample_fraction is None else int(round(n_count / sample_fraction))
+
+    return {'rows': n_rows,
+            'row_bytes': row_bytes,
+            'bytes': n_rows * row_bytes,
+            'download_time': n_rows * row_bytes / bandwidth}
+
+
+def print_estimate(estimate: dict) -> None:
+    print('{:*^30}'.format(' estimate '))
+    print('{:<14}{:<12d}'.format('rows', estimate['rows']))
+    print('{:<14}{:<12.1f}'.format('row bytes', estimate['row_bytes']))
+    print('{:<14}{:<12.2f}'.format('size (MB)', estimate['bytes'] / 10 ** 6))
+    print('{:<14}{:<12.1f}'.format('download (s)', estimate['download_time']))
+    print('{:*^30}'.format(''))
+
+
+def _equal_volume_edges(shard_low: float, shard_high: float,
+                        x_coord: float, cut_radius: float, n_shard: int) -> list[float]:
+    # edges along X splitting the part of the sphere between shard_low and shard_high into
+    # n_shard slabs of equal volume, i.e. solving the cumulative slab volume 3u - u^3 for each edge
+    def cumulative_volume(x: float) -> float:
+        u = min(max((x - x_coord) / cut_radius, -1.), 1.)
+        return 3 * u - u ** 3
+
+    volume_low = cumulative_volume(shard_low)
+    volume_high = cumulative_volume(shard_high)
+    list_edge = [shard_low]
+    for idx in range(1, n_shard):
+        target = volume_low + (volume_high - volume_low) * idx / n_shard
+        edge_low, edge_high = shard_low, shard_high
+        for _ in range(60):
+            edge_mid = (edge_low + edge_high) / 2
+            if cumulative_volume(edge_mid) < target:
+                edge_low = edge_mid
+            else:
+                edge_high = edge_mid
+        list_edge.append((edge_low + edge_high) / 2)
+    list_edge.append(shard_high)
+    return list_edge
+
+
+def tap_query(x_coord: float, y_coord: float, z_coord: float,
+              query_mode: str,
+              cut_radius: int = 100, maxrec: int = 10 ** 9,
+              columns: str = '*',
+              dry_run: bool = False,
+              sample_fraction: float = None,
+              max_rows: int = None,
+              max_bytes: float = None,
+              auto_shard: bool = False,
+              min_shard_width: float = 0.1,
+              bandwidth: float = 2 * 10 ** 6) -> astropy.table.table.Table | dict:
+    # dry_run returns the estimate only
+    # with max_rows / max_bytes the query is estimated first, and above the limits
+    # it is either split into slabs along X (auto_shard) or submitted after a warning;
+    # slabs narrower than min_shard_width (pc) are not split any further
+    _check_query_mode(query_mode)
+
+    n_shard = 1
+    if dry_run or (max_rows is not None) or (max_bytes is not None):
+        estimate = tap_estimate(x_coord, y_coord, z_coord, query_mode,
+                                cut_radius=cut_radius, columns=columns,
+                                sample_fraction=sample_fraction, bandwidth=bandwidth)
+        print_estimate(estimate)
+        if dry_run:
+            return estimate
+
+        # both limits as a number of rows per shard, which is also the maxrec of each shard
+        row_limit = maxrec if max_rows is None else min(max_rows, maxrec)
+        if max_bytes is not None:
+            row_limit = min(row_limit, max(1, int(max_bytes / estimate['row_bytes'])))
+        n_shard = math.ceil(estimate['rows'] / row_limit)
+        if n_shard > 1:
+            if auto_shard:
+                print(f'splitting the query into {n_shard} shards along X')
+            else:
+                print(f'WARNING: the estimated query exceeds the limits by a factor of {n_shard}, '
+                      'consider enabling auto_shard or reducing the radius')
+                n_shard = 1
+
+    tap_service = pyvo.dal.TAPService(dict_TAP_server[query_mode])
+    if n_shard == 1:
+        print(f'querying from {dict_TAP_server[query_mode]}', end='\r')
+        adql_query = tap_adql_query(x_coord, y_coord, z_coord, query_mode,
+                                    cut_radius=cut_radius, columns=columns)
+        return tap_service.run_async(adql_query, maxrec=maxrec).to_table()
+
+    list_edge = _equal_volume_edges(x_coord - cut_radius, x_coord + cut_radius,
+                                    x_coord, cut_radius, n_shard)
+    list_shard = list(zip(list_edge[:-1], list_edge[1:]))
+    list_table = []
+    while list_shard:
+        shard_low, shard_high = list_shard.pop(0)
+        print(f'querying from {dict_TAP_server[query_mode]} '
+              f'(X in [{shard_low:.2f}, {shard_high:.2f}), {len(list_shard)} shards left)', end='\r')
+        adql_query = tap_adql_query(x_coord, y_coord, z_coord, query_mode,
+                                    cut_radius=cut_radius, columns=columns)
+        adql_query += f' AND ({adql_x} >= {shard_low}) AND ({adql_x} < {shard_high})'
+        # one row more than the limit tells a full shard from a truncated one
+        shard_table = tap_service.run_async(adql_query, maxrec=row_limit + 1).to_table()
+        # stars are not spread uniformly, a shard above the limit is split again
+        if len(shard_table) > row_limit:
+            if shard_high - shard_low < 2 * min_shard_width:
+                print(f'WARNING: shard X in [{shard_low:.4f}, {shard_high:.4f}) is above the limit '
+                      f'but too narrow to split, it may be truncated at {row_limit + 1} rows')
+                list_table.append(shard_table)
+                continue
+            print(f'shard X in [{shard_low:.2f}, {shard_high:.2f}) is above the limit, splitting it again')
+            list_edge = _equal_volume_edges(shard_low, shard_high, x_coord, cut_radius, 2)
+            list_shard = list(zip(list_edge[:-1], list_edge[1:])) + list_shard
+            continue
+        list_table.append(shard_table)
+
+    return astropy.table.vstack(list_table)